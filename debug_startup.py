@@ -0,0 +1,209 @@
+"""
+Mede o tempo até /ready com um VoIPPhone falso (sem PABX nem rede) e
+exercita o monitor de registro SIP.
+
+Uso:
+    python debug_startup.py cache    # IP público vindo do cache em disco
+    python debug_startup.py ipify    # sem cache: consulta ao ipify (latência simulada)
+    python debug_startup.py expire      # re-REGISTER periódico falha com chamada ativa
+    python debug_startup.py pabx-down   # PABX cai sem chamadas ativas -> recria o cliente
+    python debug_startup.py ip-change   # ipify devolve IP diferente do cache -> novo REGISTER
+"""
+import time
+
+SCRIPT_STARTED_AT = time.monotonic()
+
+import os
+import sys
+import tempfile
+import threading
+
+os.environ.setdefault('SIP_AUTOSTART', 'false')
+os.environ.setdefault('SIP_MONITOR_INTERVAL', '1')
+os.environ['PUBLIC_IP_CACHE_FILE'] = os.path.join(tempfile.mkdtemp(), 'public_ip_cache')
+
+import server
+
+IPIFY_DELAY = 0.8    # Latência típica de HTTPS até api.ipify.org
+REGISTER_DELAY = 0.15  # REGISTER + 401 + REGISTER autenticado no PABX
+
+
+class FakeResponse:
+    text = "203.0.113.10"
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeChangedResponse(FakeResponse):
+    text = "203.0.113.20"
+
+
+def fake_requests_get(url, **kwargs):
+    time.sleep(IPIFY_DELAY)
+    return FakeResponse()
+
+
+def fake_requests_get_changed(url, **kwargs):
+    time.sleep(IPIFY_DELAY)
+    return FakeChangedResponse()
+
+
+class FakeSocket:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSIPClient:
+    """
+    Imita o SIPClient do pyVoIP 1.6.5: o re-REGISTER roda num Timer e, com o
+    PABX fora, register()/deregister() levantam TimeoutError segurando recvLock.
+    """
+    pabx_up = True
+
+    def __init__(self, myIP):
+        self.myIP = myIP
+        self.recvLock = threading.Lock()
+        self.register_timeout = 1
+        self.registerThread = None
+        self.registrations = 0
+        self.NSD = False
+        self.s = self.out = None
+
+    def start(self):
+        self.NSD = True
+        self.s = self.out = FakeSocket()
+        self.register()
+
+    def register(self):
+        self.recvLock.acquire()
+        time.sleep(REGISTER_DELAY)
+        if not FakeSIPClient.pabx_up:
+            time.sleep(self.register_timeout)
+            raise TimeoutError("Registering on SIP Server timed out")
+        self.recvLock.release()
+        self.registrations += 1
+        if self.NSD:
+            self.registerThread = threading.Timer(3600, self.register)
+            self.registerThread.daemon = True
+            self.registerThread.start()
+        return True
+
+    def deregister(self):
+        self.recvLock.acquire()  # Sem timeout, como no pyVoIP: trava se o lock vazou
+        self.recvLock.release()
+
+    def stop(self):
+        self.NSD = False
+        if self.registerThread:
+            self.registerThread.cancel()
+            self.deregister()
+        self.s.close()
+
+    def expire(self):
+        # Simula o Timer que disparou, deu timeout no PABX e morreu segurando recvLock
+        self.registerThread.cancel()
+        self.registerThread.join()
+        self.recvLock.acquire()
+
+
+class FakeVoIPPhone:
+    def __init__(self, myIP=None, **kwargs):
+        self.myIP = myIP
+        self.sip = FakeSIPClient(myIP)
+        self._status = server.PhoneStatus.INACTIVE
+        self.stopped = False
+
+    def start(self):
+        self._status = server.PhoneStatus.REGISTERING
+        try:
+            self.sip.start()
+        except Exception:
+            self._status = server.PhoneStatus.FAILED
+            self.sip.stop()
+            raise
+        self._status = server.PhoneStatus.REGISTERED
+
+    def stop(self):
+        self.stopped = True
+        self.sip.stop()
+        self._status = server.PhoneStatus.INACTIVE
+
+
+class FakeBridge:
+    call_id = "fake-call"
+    request_id = None
+
+
+def wait_ready(timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.is_ready():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def main():
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'cache'
+    import_s = time.monotonic() - SCRIPT_STARTED_AT
+
+    server.requests.get = fake_requests_get_changed if mode == 'ip-change' else fake_requests_get
+    if mode != 'ipify':
+        server.save_cached_public_ip("203.0.113.10")
+
+    load_heavy_imports = server.load_heavy_imports
+
+    def load_with_fake_phone():
+        load_heavy_imports()
+        server.VoIPPhone = FakeVoIPPhone
+
+    server.load_heavy_imports = load_with_fake_phone
+    server.ensure_sip_supervisor()
+
+    ok = wait_ready()
+    ready_s = time.monotonic() - SCRIPT_STARTED_AT
+    print(f"import do server: {import_s:.3f}s | pronto: {ready_s:.3f}s "
+          f"(time_to_ready_s={server.startup_state['time_to_ready_s']}, "
+          f"IP via {server.startup_state['public_ip_source']})")
+
+    if mode == 'expire':
+        phone = server.sip_client
+        server.active_calls.register(FakeBridge())
+        phone.sip.expire()
+        print(f"após falha do re-REGISTER: pronto={server.is_ready()}")
+        ok = ok and not server.is_ready() and wait_ready(20)
+        ok = ok and server.sip_client is phone and not phone.stopped and phone.sip.registrations == 2
+        print(f"registrado de novo no mesmo cliente, sem derrubar chamadas: {ok}")
+
+    elif mode == 'pabx-down':
+        phone = server.sip_client
+        old_socket = phone.sip.s
+        FakeSIPClient.pabx_up = False
+        phone.sip.expire()
+        # O PABX volta enquanto o supervisor tenta recriar o cliente
+        threading.Timer(phone.sip.register_timeout + server.RECV_LOCK_LEAK_GRACE_SECONDS + 3,
+                        setattr, (FakeSIPClient, 'pabx_up', True)).start()
+        ok = ok and not wait_ready(1) and wait_ready(40)
+        ok = ok and server.sip_client is not phone and not phone.stopped and old_socket.closed
+        print(f"cliente recriado sem deregister travado, socket antigo fechado: {ok} "
+              f"(tentativas SIP: {server.startup_state['sip_attempts']})")
+
+    elif mode == 'ip-change':
+        phone = server.sip_client
+        deadline = time.monotonic() + 10
+        while phone.sip.registrations < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        ok = (ok and server.sip_client is phone and phone.sip.registrations == 2
+              and phone.myIP == phone.sip.myIP == FakeChangedResponse.text and wait_ready())
+        print(f"novo REGISTER com IP {phone.sip.myIP} em SDP e headers: {ok}")
+
+    print("✅ OK" if ok else "❌ FALHOU")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()